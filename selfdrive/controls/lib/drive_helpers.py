@@ -1,8 +1,9 @@
 import math
+from functools import lru_cache
 
 from cereal import car
 from common.conversions import Conversions as CV
-from common.numpy_fast import clip, interp
+from common.numpy_fast import clip
 from common.params import Params
 from common.realtime import DT_MDL, DT_CTRL
 from selfdrive.modeld.constants import T_IDXS
@@ -22,22 +23,28 @@ LAT_MPC_N = 16
 LON_MPC_N = 32
 CONTROL_N = 17
 CAR_ROTATION_RADIUS = 0.0
+_T_IDXS_C = tuple(T_IDXS[:CONTROL_N])
+_ZEROS_C = (0.0,) * CONTROL_N
 
 # EU guidelines
 MAX_LATERAL_JERK = 5.0
+_MAX_JERK_DT_MDL = MAX_LATERAL_JERK * DT_MDL
 
 ButtonEvent = car.CarState.ButtonEvent
 ButtonType = car.CarState.ButtonEvent.Type
 CRUISE_LONG_PRESS = 50
-CRUISE_NEAREST_FUNC = {
-  ButtonType.accelCruise: math.ceil,
-  ButtonType.decelCruise: math.floor,
-}
 CRUISE_INTERVAL_SIGN = {
   ButtonType.accelCruise: +1,
   ButtonType.decelCruise: -1,
 }
 
+# schema enumerants are plain ints, compare them against ButtonEvent.type.raw
+_ACCEL_RAW = int(ButtonType.accelCruise)
+_DECEL_RAW = int(ButtonType.decelCruise)
+_BUTTON_RAW_SET = frozenset((_ACCEL_RAW, _DECEL_RAW))
+_GAS_OVERRIDE_BTNS = frozenset((int(ButtonType.decelCruise), int(ButtonType.setCruise)))
+_INIT_BTN_RAW = frozenset((int(ButtonType.accelCruise), int(ButtonType.resumeCruise)))
+
 
 # Constants for Limit controllers.
 LIMIT_ADAPT_ACC = -1.  # m/s^2 Ideal acceleration for the adapting (braking) phase when approaching speed limits.
@@ -47,15 +54,58 @@ LIMIT_MIN_SPEED = 8.33  # m/s, Minimum speed limit to provide as solution on lim
 LIMIT_SPEED_OFFSET_TH = -1.  # m/s Maximum offset between speed limit and current speed for adapting state.
 LIMIT_MAX_MAP_DATA_AGE = 10.  # s Maximum time to hold to map data, then consider it invalid inside limits controllers.
 
+PARAMS_UPDATE_PERIOD = 100  # frames, poll params at 1Hz instead of every control tick
+
+
+# Honda non-metric set speed is held in display mph while buttons are handled,
+# both conversions round half up on non-negative speeds
+@lru_cache(maxsize=256)
+def _kph_to_mph_display(v_cruise_kph):
+  return int(v_cruise_kph * 0.6233 + 0.0995 + 0.5)
+
+
+@lru_cache(maxsize=256)
+def _mph_display_to_kph(v_cruise_mph):
+  return int((round(v_cruise_mph) - 0.0995) / 0.6233 + 0.5)
+
+
+# Honda set speed steps: next multiple of V_CRUISE_DELTA_HONDA strictly above/below, or a single unit
+def _next_mult_up(v, m=V_CRUISE_DELTA_HONDA):
+  return (v // m + 1) * m
+
+
+def _next_mult_down(v, m=V_CRUISE_DELTA_HONDA):
+  return (-(-v // m) - 1) * m
+
+
+def _next_unit_up(v):
+  return v + 1
+
+
+def _next_unit_down(v):
+  return v - 1
+
 
 class VCruiseHelper:
+  # touched every control tick, keep attribute access off the instance dict
+  __slots__ = ('CP', 'pcm_cruise_speed', 'v_cruise_kph', 'v_cruise_cluster_kph', 'v_cruise_kph_last', 'v_cruise_initialized',
+               'accel_timer', 'decel_timer', 'standstill_at_accel_press', 'standstill_at_decel_press',
+               'param_s', 'accel_pressed', 'decel_pressed', 'accel_pressed_last', 'decel_pressed_last', 'fastMode',
+               'reverse_acc_change', 'is_metric', 'v_cruise_delta', 'v_cruise_delta_multiplier')
+
   def __init__(self, CP):
     self.CP = CP
+    # set speed is entirely handled by the PCM
+    self.pcm_cruise_speed = CP.pcmCruise and CP.pcmCruiseSpeed
     self.v_cruise_kph = V_CRUISE_INITIAL
     self.v_cruise_cluster_kph = V_CRUISE_INITIAL
     self.v_cruise_kph_last = 0
-    self.button_timers = {ButtonType.decelCruise: 0, ButtonType.accelCruise: 0}
-    self.button_change_states = {btn: {"standstill": False} for btn in self.button_timers}
+    # kept in sync with v_cruise_kph != V_CRUISE_INITIAL wherever the set speed is written
+    self.v_cruise_initialized = False
+    self.accel_timer = 0
+    self.decel_timer = 0
+    self.standstill_at_accel_press = False
+    self.standstill_at_decel_press = False
 
     self.param_s = Params()
     self.accel_pressed = False
@@ -65,56 +115,75 @@ class VCruiseHelper:
     self.fastMode = False
     self.reverse_acc_change = self.param_s.get_bool("ReverseAccChange")
 
-  @property
-  def v_cruise_initialized(self):
-    return self.v_cruise_kph != V_CRUISE_INITIAL
+    # unit dependent button intervals, recomputed only when the unit setting changes
+    self.is_metric = None
+    self.v_cruise_delta = 1.
+    self.v_cruise_delta_multiplier = 10
 
   def update_v_cruise(self, CS, enabled_long, is_metric, sm):
-    self.v_cruise_kph_last = self.v_cruise_kph
+    if self.pcm_cruise_speed:
+      if CS.cruiseState.available:
+        self.v_cruise_kph = CS.cruiseState.speed * CV.MS_TO_KPH
+        self.v_cruise_cluster_kph = CS.cruiseState.speedCluster * CV.MS_TO_KPH
+        self.v_cruise_initialized = True
+      else:
+        self.v_cruise_kph = V_CRUISE_INITIAL
+        self.v_cruise_cluster_kph = V_CRUISE_INITIAL
+        self.v_cruise_initialized = False
+      return
 
-    self.reverse_acc_change = self.param_s.get_bool("ReverseAccChange")
-    cur_time = sm.frame * DT_CTRL
+    self.v_cruise_kph_last = self.v_cruise_kph
 
     if CS.cruiseState.available:
-      if not self.CP.pcmCruise or not self.CP.pcmCruiseSpeed:
-        if CS.cruiseState.enabled:
-          # if stock cruise is completely disabled, then we can use our own set speed logic
-          if self.CP.carName == "honda":
-            for b in CS.buttonEvents:
-              if b.pressed:
-                if b.type == ButtonType.accelCruise:
-                  self.accel_pressed = True
-                  self.accel_pressed_last = cur_time
-                elif b.type == ButtonType.decelCruise:
-                  self.decel_pressed = True
-                  self.decel_pressed_last = cur_time
-              else:
-                if b.type == ButtonType.accelCruise:
-                  self.accel_pressed = False
-                elif b.type == ButtonType.decelCruise:
-                  self.decel_pressed = False
-            self._update_v_cruise_non_pcm_honda(CS, enabled_long, is_metric, cur_time)
-            self.v_cruise_kph = self.v_cruise_kph if is_metric else int(round((float(round(self.v_cruise_kph)) - 0.0995) / 0.6233))
-            self.v_cruise_cluster_kph = self.v_cruise_kph
-            if self.accel_pressed or self.decel_pressed:
-              if self.v_cruise_kph_last != self.v_cruise_kph:
+      if sm.frame % PARAMS_UPDATE_PERIOD == 0:
+        self.reverse_acc_change = self.param_s.get_bool("ReverseAccChange")
+
+      if CS.cruiseState.enabled:
+        cur_time = sm.frame * DT_CTRL
+        # if stock cruise is completely disabled, then we can use our own set speed logic
+        if self.CP.carName == "honda":
+          # single pass over the button events, the set speed update only needs their summary
+          accel_released = decel_released = set_event = False
+          for b in CS.buttonEvents:
+            btype = b.type.raw
+            if b.pressed:
+              if btype == _ACCEL_RAW:
+                self.accel_pressed = True
                 self.accel_pressed_last = cur_time
+              elif btype == _DECEL_RAW:
+                self.decel_pressed = True
                 self.decel_pressed_last = cur_time
-                self.fastMode = True
             else:
-              self.fastMode = False
+              if btype == _ACCEL_RAW:
+                self.accel_pressed = False
+                accel_released = True
+              elif btype == _DECEL_RAW:
+                self.decel_pressed = False
+                decel_released = True
+            if btype in _GAS_OVERRIDE_BTNS:
+              set_event = True
+          self._update_v_cruise_non_pcm_honda(CS, enabled_long, is_metric, cur_time, accel_released, decel_released, set_event)
+          self.v_cruise_kph = self.v_cruise_kph if is_metric else _mph_display_to_kph(self.v_cruise_kph)
+          self.v_cruise_cluster_kph = self.v_cruise_kph
+          if self.accel_pressed or self.decel_pressed:
+            if self.v_cruise_kph_last != self.v_cruise_kph:
+              self.accel_pressed_last = cur_time
+              self.decel_pressed_last = cur_time
+              self.fastMode = True
           else:
-            self._update_v_cruise_non_pcm(CS, enabled_long, is_metric)
-            self.v_cruise_cluster_kph = self.v_cruise_kph
-            self.update_button_timers(CS)
-      else:
-        self.v_cruise_kph = CS.cruiseState.speed * CV.MS_TO_KPH
-        self.v_cruise_cluster_kph = CS.cruiseState.speedCluster * CV.MS_TO_KPH
+            self.fastMode = False
+        else:
+          # read the capnp button events once, both consumers below iterate plain tuples
+          button_events = [(b.type.raw, b.pressed) for b in CS.buttonEvents]
+          self._update_v_cruise_non_pcm(CS, button_events, enabled_long, is_metric)
+          self.v_cruise_cluster_kph = self.v_cruise_kph
+          self.update_button_timers(CS, button_events)
     else:
       self.v_cruise_kph = V_CRUISE_INITIAL
       self.v_cruise_cluster_kph = V_CRUISE_INITIAL
+      self.v_cruise_initialized = False
 
-  def _update_v_cruise_non_pcm(self, CS, enabled_long, is_metric):
+  def _update_v_cruise_non_pcm(self, CS, button_events, enabled_long, is_metric):
     # handle button presses. TODO: this should be in state_control, but a decelCruise press
     # would have the effect of both enabling and changing speed is checked after the state transition
     if not enabled_long:
@@ -123,134 +192,152 @@ class VCruiseHelper:
     long_press = False
     button_type = None
 
-    # should be CV.MPH_TO_KPH, but this causes rounding errors
-    v_cruise_delta = 1. if is_metric else 1.6
-    v_cruise_delta_multiplier = 10 if is_metric else 5
-
-    for b in CS.buttonEvents:
-      if b.type.raw in self.button_timers and not b.pressed:
-        if self.button_timers[b.type.raw] > CRUISE_LONG_PRESS:
+    if is_metric != self.is_metric:
+      self.is_metric = is_metric
+      # should be CV.MPH_TO_KPH, but this causes rounding errors
+      self.v_cruise_delta = 1. if is_metric else 1.6
+      self.v_cruise_delta_multiplier = 10 if is_metric else 5
+    v_cruise_delta = self.v_cruise_delta
+    v_cruise_delta_multiplier = self.v_cruise_delta_multiplier
+
+    for btype, pressed in button_events:
+      if btype in _BUTTON_RAW_SET and not pressed:
+        if (self.accel_timer if btype == _ACCEL_RAW else self.decel_timer) > CRUISE_LONG_PRESS:
           return  # end long press
-        button_type = b.type.raw
+        button_type = btype
         break
     else:
-      for k in self.button_timers.keys():
-        if self.button_timers[k] and self.button_timers[k] % CRUISE_LONG_PRESS == 0:
-          button_type = k
-          long_press = True
-          break
+      if self.decel_timer and self.decel_timer % CRUISE_LONG_PRESS == 0:
+        button_type = _DECEL_RAW
+        long_press = True
+      elif self.accel_timer and self.accel_timer % CRUISE_LONG_PRESS == 0:
+        button_type = _ACCEL_RAW
+        long_press = True
 
     if button_type is None:
       return
 
     # Don't adjust speed when pressing resume to exit standstill
-    cruise_standstill = self.button_change_states[button_type]["standstill"] or CS.cruiseState.standstill
-    if button_type == ButtonType.accelCruise and cruise_standstill:
+    standstill_at_press = self.standstill_at_accel_press if button_type == _ACCEL_RAW else self.standstill_at_decel_press
+    cruise_standstill = standstill_at_press or CS.cruiseState.standstill
+    if button_type == _ACCEL_RAW and cruise_standstill:
       return
 
+    sign = CRUISE_INTERVAL_SIGN[button_type]
     if self.reverse_acc_change:
       v_cruise_delta = v_cruise_delta * (1 if long_press else v_cruise_delta_multiplier)
       if not long_press and self.v_cruise_kph % v_cruise_delta != 0:  # partial interval
-        self.v_cruise_kph = CRUISE_NEAREST_FUNC[button_type](self.v_cruise_kph / v_cruise_delta) * v_cruise_delta
+        # round to the nearest interval in the direction of the press
+        self.v_cruise_kph = (self.v_cruise_kph // v_cruise_delta + (sign > 0)) * v_cruise_delta
       else:
-        self.v_cruise_kph += v_cruise_delta * CRUISE_INTERVAL_SIGN[button_type]
+        self.v_cruise_kph += v_cruise_delta * sign
     else:
       v_cruise_delta = v_cruise_delta * (v_cruise_delta_multiplier if long_press else 1)
       if long_press and self.v_cruise_kph % v_cruise_delta != 0:  # partial interval
-        self.v_cruise_kph = CRUISE_NEAREST_FUNC[button_type](self.v_cruise_kph / v_cruise_delta) * v_cruise_delta
+        # round to the nearest interval in the direction of the press
+        self.v_cruise_kph = (self.v_cruise_kph // v_cruise_delta + (sign > 0)) * v_cruise_delta
       else:
-        self.v_cruise_kph += v_cruise_delta * CRUISE_INTERVAL_SIGN[button_type]
+        self.v_cruise_kph += v_cruise_delta * sign
 
     # If set is pressed while overriding, clip cruise speed to minimum of vEgo
-    if CS.gasPressed and button_type in (ButtonType.decelCruise, ButtonType.setCruise):
+    if CS.gasPressed and button_type in _GAS_OVERRIDE_BTNS:
       self.v_cruise_kph = max(self.v_cruise_kph, CS.vEgo * CV.MS_TO_KPH)
 
     self.v_cruise_kph = clip(round(self.v_cruise_kph, 1), V_CRUISE_MIN, V_CRUISE_MAX)
+    self.v_cruise_initialized = True
 
-  def _update_v_cruise_non_pcm_honda(self, CS, enabled_long, is_metric, cur_time):
+  def _update_v_cruise_non_pcm_honda(self, CS, enabled_long, is_metric, cur_time, accel_released, decel_released, set_event):
 
-    self.v_cruise_kph = self.v_cruise_kph if is_metric else int(round((float(self.v_cruise_kph) * 0.6233 + 0.0995)))
+    self.v_cruise_kph = self.v_cruise_kph if is_metric else _kph_to_mph_display(self.v_cruise_kph)
 
     if enabled_long:
+      # holding a button and tapping it step the set speed in opposite increments
+      if self.reverse_acc_change:
+        hold_up, hold_down, tap_up, tap_down = _next_unit_up, _next_unit_down, _next_mult_up, _next_mult_down
+      else:
+        hold_up, hold_down, tap_up, tap_down = _next_mult_up, _next_mult_down, _next_unit_up, _next_unit_down
+
       if self.accel_pressed:
         if (cur_time - self.accel_pressed_last) >= 1 or (self.fastMode and (cur_time - self.accel_pressed_last) >= 0.5):
-          if self.reverse_acc_change:
-            self.v_cruise_kph += 1
-          else:
-            self.v_cruise_kph += V_CRUISE_DELTA_HONDA - (self.v_cruise_kph % V_CRUISE_DELTA_HONDA)
+          self.v_cruise_kph = hold_up(self.v_cruise_kph)
       elif self.decel_pressed:
         if (cur_time - self.decel_pressed_last) >= 1 or (self.fastMode and (cur_time - self.decel_pressed_last) >= 0.5):
-          if self.reverse_acc_change:
-            self.v_cruise_kph -= 1
-          else:
-            self.v_cruise_kph -= V_CRUISE_DELTA_HONDA - ((V_CRUISE_DELTA_HONDA - self.v_cruise_kph) % V_CRUISE_DELTA_HONDA)
+          self.v_cruise_kph = hold_down(self.v_cruise_kph)
       else:
-        for b in CS.buttonEvents:
-          if not b.pressed:
-            if b.type == ButtonType.accelCruise:
-              if not self.fastMode:
-                if self.reverse_acc_change:
-                  self.v_cruise_kph += V_CRUISE_DELTA_HONDA - (self.v_cruise_kph % V_CRUISE_DELTA_HONDA)
-                else:
-                  self.v_cruise_kph += 1
-            elif b.type == ButtonType.decelCruise:
-              if not self.fastMode:
-                if self.reverse_acc_change:
-                  self.v_cruise_kph -= V_CRUISE_DELTA_HONDA - ((V_CRUISE_DELTA_HONDA - self.v_cruise_kph) % V_CRUISE_DELTA_HONDA)
-                else:
-                  self.v_cruise_kph -= 1
-
-          # If set is pressed while overriding, clip cruise speed to minimum of vEgo
-          if CS.gasPressed and b.type in (ButtonType.decelCruise, ButtonType.setCruise):
-            self.v_cruise_kph = max(self.v_cruise_kph, CS.vEgo * CV.MS_TO_KPH)
+        if not self.fastMode:
+          if accel_released:
+            self.v_cruise_kph = tap_up(self.v_cruise_kph)
+          if decel_released:
+            self.v_cruise_kph = tap_down(self.v_cruise_kph)
+
+        # If set is pressed while overriding, clip cruise speed to minimum of vEgo
+        if CS.gasPressed and set_event:
+          self.v_cruise_kph = max(self.v_cruise_kph, CS.vEgo * CV.MS_TO_KPH)
 
       self.v_cruise_kph = clip(self.v_cruise_kph, V_CRUISE_MIN_HONDA, V_CRUISE_MAX)
+      self.v_cruise_initialized = True
 
-  def update_button_timers(self, CS):
+  def update_button_timers(self, CS, button_events):
     # increment timer for buttons still pressed
-    for k in self.button_timers:
-      if self.button_timers[k] > 0:
-        self.button_timers[k] += 1
-
-    for b in CS.buttonEvents:
-      if b.type.raw in self.button_timers:
-        # Start/end timer and store current state on change of button pressed
-        self.button_timers[b.type.raw] = 1 if b.pressed else 0
-        self.button_change_states[b.type.raw] = {"standstill": CS.cruiseState.standstill}
+    self.accel_timer += self.accel_timer > 0
+    self.decel_timer += self.decel_timer > 0
+
+    # Start/end timer and store current state on change of button pressed
+    for btype, pressed in button_events:
+      if btype == _ACCEL_RAW:
+        self.accel_timer = 1 if pressed else 0
+        self.standstill_at_accel_press = CS.cruiseState.standstill
+      elif btype == _DECEL_RAW:
+        self.decel_timer = 1 if pressed else 0
+        self.standstill_at_decel_press = CS.cruiseState.standstill
 
   def initialize_v_cruise(self, CS, is_metric):
     # initializing is handled by the PCM
-    if self.CP.pcmCruise and self.CP.pcmCruiseSpeed:
+    if self.pcm_cruise_speed:
       return
 
+    resume_pressed = False
+    for b in CS.buttonEvents:
+      if b.type.raw in _INIT_BTN_RAW:
+        resume_pressed = True
+        break
+
     # 250kph or above probably means we never had a set speed
-    if any(b.type in (ButtonType.accelCruise, ButtonType.resumeCruise) for b in CS.buttonEvents) and self.v_cruise_kph_last < 250:
+    if resume_pressed and self.v_cruise_kph_last < 250:
       self.v_cruise_kph = self.v_cruise_kph_last
     else:
       self.v_cruise_kph = int(round(clip(CS.vEgo * CV.MS_TO_KPH, V_CRUISE_ENABLE_MIN_KPH if is_metric else V_CRUISE_ENABLE_MIN_MPH, V_CRUISE_MAX)))
 
     self.v_cruise_cluster_kph = self.v_cruise_kph
+    self.v_cruise_initialized = True
 
 
 def apply_deadzone(error, deadzone):
-  if error > deadzone:
-    error -= deadzone
-  elif error < - deadzone:
-    error += deadzone
-  else:
-    error = 0.
-  return error
+  abs_error = abs(error)
+  return math.copysign(abs_error - deadzone, error) if abs_error > deadzone else 0.
 
 
 def rate_limit(new_value, last_value, dw_step, up_step):
   return clip(new_value, last_value + dw_step, last_value + up_step)
 
 
+@lru_cache(maxsize=None)
+def _control_interp_weights(t):
+  # bracketing indices and weight to linearly interpolate a CONTROL_N plan at time t, same as interp
+  hi = 0
+  while hi < CONTROL_N and t > _T_IDXS_C[hi]:
+    hi += 1
+  if hi == 0:
+    return 0, 0, 0.
+  if hi == CONTROL_N:
+    return CONTROL_N - 1, CONTROL_N - 1, 0.
+  low = hi - 1
+  return low, hi, (t - _T_IDXS_C[low]) / (_T_IDXS_C[hi] - _T_IDXS_C[low])
+
+
 def get_lag_adjusted_curvature(CP, v_ego, psis, curvatures, curvature_rates):
   if len(psis) != CONTROL_N:
-    psis = [0.0]*CONTROL_N
-    curvatures = [0.0]*CONTROL_N
-    curvature_rates = [0.0]*CONTROL_N
+    psis = curvatures = curvature_rates = _ZEROS_C
   v_ego = max(MIN_SPEED, v_ego)
 
   # TODO this needs more thought, use .2s extra for now to estimate other delays
@@ -260,18 +347,21 @@ def get_lag_adjusted_curvature(CP, v_ego, psis, curvatures, curvature_rates):
   # in high delay cases some corrections never even get commanded. So just use
   # psi to calculate a simple linearization of desired curvature
   current_curvature_desired = curvatures[0]
-  psi = interp(delay, T_IDXS[:CONTROL_N], psis)
+  low, hi, w = _control_interp_weights(delay)
+  psi = psis[low] + w * (psis[hi] - psis[low])
   average_curvature_desired = psi / (v_ego * delay)
   desired_curvature = 2 * average_curvature_desired - current_curvature_desired
 
   # This is the "desired rate of the setpoint" not an actual desired rate
   desired_curvature_rate = curvature_rates[0]
-  max_curvature_rate = MAX_LATERAL_JERK / (v_ego**2) # inexact calculation, check https://github.com/commaai/openpilot/pull/24755
+  inv_v2 = 1.0 / (v_ego * v_ego)
+  max_curvature_rate = MAX_LATERAL_JERK * inv_v2 # inexact calculation, check https://github.com/commaai/openpilot/pull/24755
+  max_curvature_delta = _MAX_JERK_DT_MDL * inv_v2
   safe_desired_curvature_rate = clip(desired_curvature_rate,
                                      -max_curvature_rate,
                                      max_curvature_rate)
   safe_desired_curvature = clip(desired_curvature,
-                                current_curvature_desired - max_curvature_rate * DT_MDL,
-                                current_curvature_desired + max_curvature_rate * DT_MDL)
+                                current_curvature_desired - max_curvature_delta,
+                                current_curvature_desired + max_curvature_delta)
 
   return safe_desired_curvature, safe_desired_curvature_rate